@@ -9,20 +9,18 @@ Streamlit · SRT ▶︎ Gemini (prompt) ▶︎ Replicate (imagem)
 • Exibe galeria, download individual, ZIP e TXT de prompts.
 """
 from __future__ import annotations
-import os, io, zipfile, time, re
-from pathlib import Path
-from typing import List
+import time, hashlib, threading
+from collections import deque
+from functools import partial
 
 import streamlit as st
-import pysrt
 import replicate                                # pip install replicate
-from PIL import Image
-from io import BytesIO
 
 import google.genai as genai
 from google.genai import types
 
-import time
+from core import (TIMEOUT_MS, CACHE_IMG_RAM, Prompts, Limitador, _e_limite, espera, iniciar_sessao, filtros,
+                  selecionar, rodar, galeria, pasta_app, restaurar_rodada, nova_rodada)
 
 # ─── Configurações ─────────────────────────────
 STYLE_SUFFIX = (
@@ -32,68 +30,86 @@ STYLE_SUFFIX = (
     #"dark gothic atmosphere, dramatic shadows, deep reds and browns, cinematic high contrast, 4K detail, photorealistic, photography"
     #"high detailed, no text overlay." 
 )
+MODELO_TXT = "gemini-2.5-flash-lite-preview-06-17"
+MODELO_IMG = "black-forest-labs/flux-schnell"
+RPM_TXT = 15          # cota por minuto do modelo de texto (10 no 2.5 flash, 15 no lite/2.0)
+
+# Pedidos ao modelo de texto: {cena}/{cenas}, {n} e {estilo} são preenchidos por core.Prompts
+PEDIDO = (
+    "Create a creative, image generation prompt that represents "
+    #"this biblical scene. Always bring a biblical setting, an environment of the time. The prompt must end with the quality parameters. "
+    #"this biblical scene, with a beautiful ancient Middle Eastern setting. Capture the character emotion. The prompt must end with the quality parameters." # and only one part of image in blue, red ou yellow color.
+    #"This biblical scene, set against a beautiful ancient Middle Eastern backdrop. Capture the emotion of the character or simply the beauty of the historical setting. The prompt should end with the quality parameters."
+    #This biblical scene (biblical times), sharpness, set against a beautiful ancient Middle Eastern backdrop. If there is a man in the scene, he should be: 35 years old (has a beard and mustache). If there is a woman in the scene, she should be: 30 years old and is very beautiful and has black hair. The prompt should end with the quality parameters."
+    "This scene with no text, no hands, no chairs, no sofa, no armchair, no tree, for seniors. The prompt should end with the quality parameters."
+    #"This scene with no text. The prompt should end with the quality parameters."
+    "\n\nScene:\n{cena}\n\nQuality parameters:\n{estilo}"
+)
+PEDIDO_LOTE = (
+    "Create a creative, image generation prompt that represents each scene below. "
+    "These scenes with no text, no hands, no chairs, no sofa, no armchair, no tree, for seniors. Each prompt should end with the quality parameters. "
+    "Return a JSON array of exactly {n} prompts, one per scene, in order."
+    "\n\nScenes: {cenas}\n\nQuality parameters:\n{estilo}"
+)
+
 # ─── session_state ─────────────────────────────
-if "imgs" not in st.session_state:
-    st.session_state["imgs"] = []  # [{"name","bytes","prompt"}]
-if "blocos" not in st.session_state:
-    st.session_state["blocos"] = []  # guarda blocos para reprocessar
+iniciar_sessao()
 
 # ─── Helpers ────────────────────────────────────
-def tag(t: pysrt.SubRipTime) -> str:
-    return f"{t.hours:02d}_{t.minutes:02d}_{t.seconds:02d}_{int(t.milliseconds):03d}"
-
-def agrupar_blocos(subs: List[pysrt.SubRipItem], min_w=20, max_w=30):
-    blocos, txt, start = [], [], None
-    for s in subs:
-        words = s.text.replace("\n"," ").split()
-        if not words:
-            continue
-        start = start or s.start
-        txt.extend(words)
-        if len(txt) >= min_w:
-            blocos.append({"start": start, "end": s.end, "text": " ".join(txt[:max_w])})
-            txt, start = [], None
-    if txt:
-        blocos.append({"start": start, "end": subs[-1].end, "text": " ".join(txt)})
-    return blocos
-
-def clean_prompt(raw: str) -> str:
-    parts = re.split(r"\*{0,2}Prompt\*{0,2}:\s*", raw)
-    body = parts[-1] if len(parts)>1 else raw
-    body = re.sub(r"^Here(?:'|’)s a [^:]+:\s*","", body)
-    body = body.replace("*","").strip()
-    return re.sub(r"\s+", " ", body)
-
-def gerar_prompt(client_txt, texto: str) -> str:
-    pedido = (
-        "Create a creative, image generation prompt that represents "
-        #"this biblical scene. Always bring a biblical setting, an environment of the time. The prompt must end with the quality parameters. "
-        #"this biblical scene, with a beautiful ancient Middle Eastern setting. Capture the character emotion. The prompt must end with the quality parameters." # and only one part of image in blue, red ou yellow color.
-        #"This biblical scene, set against a beautiful ancient Middle Eastern backdrop. Capture the emotion of the character or simply the beauty of the historical setting. The prompt should end with the quality parameters."
-        #This biblical scene (biblical times), sharpness, set against a beautiful ancient Middle Eastern backdrop. If there is a man in the scene, he should be: 35 years old (has a beard and mustache). If there is a woman in the scene, she should be: 30 years old and is very beautiful and has black hair. The prompt should end with the quality parameters."
-        "This scene with no text, no hands, no chairs, no sofa, no armchair, no tree, for seniors. The prompt should end with the quality parameters."
-        #"This scene with no text. The prompt should end with the quality parameters."
-        f"\n\nScene:\n{texto}\n\nQuality parameters:\n{STYLE_SUFFIX}"
-    )
-    try:
-        time.sleep(2) # espera 3 segundos RPM de 10 para o modelo 2.5 flash e 15 para o 2.0 flash
-        #resp = client_txt.models.generate_content(model="gemini-2.5-flash-preview-05-2", contents=pedido) # gemini-2.0-flash
-        resp = client_txt.models.generate_content(model="gemini-2.5-flash-lite-preview-06-17", contents=pedido)
-        raw = resp.candidates[0].content.parts[0].text or ""
-        prompt = clean_prompt(raw)
-        if prompt and not prompt.startswith(texto[:10]):
-            return prompt
-    except Exception:
-        pass
-    return f"{texto}, {STYLE_SUFFIX}"
-
-def gerar_imagem_replicate(prompt: str, aspect_ratio: str="16:9") -> bytes:
-    #output = replicate.run("prunaai/flux.1-dev:970a966e3a5d8aa9a4bf13d395cf49c975dc4726e359f982fb833f9b100f75d5", input={"seed": -1, "prompt": prompt, "guidance": 3.5, "image_size": 1024, "speed_mode": "Juiced 🔥 (default)", "aspect_ratio": aspect_ratio, "output_format": "png", "output_quality": 100, "num_inference_steps": 30})
-    output = replicate.run("black-forest-labs/flux-schnell", input={"prompt": prompt, "aspect_ratio": aspect_ratio, "output_format": "png", "output_quality": 100, "seed":41270, "disable_safety_checker": True, "go_fast": False}) 
-    #output = replicate.run("minimax/image-01", input={"prompt": prompt, "aspect_ratio": aspect_ratio})
+@st.cache_resource
+def get_client(api_key: str) -> genai.Client:
+    """Client Gemini criado uma vez e reaproveitado entre reruns."""
+    return genai.Client(api_key=api_key, http_options=types.HttpOptions(timeout=TIMEOUT_MS))
+
+@st.cache_resource
+def get_replicate(token: str) -> replicate.Client:
+    """Client Replicate criado uma vez: o pool httpx dele (API e download do PNG) sobrevive aos reruns."""
+    return replicate.Client(api_token=token)
+
+class Ritmo:
+    """Janela deslizante de 60 s: no máximo `por_minuto` chamadas em qualquer minuto.
+    Só espera quando a cota está cheia; o tempo da própria chamada já conta."""
+    def __init__(self, por_minuto: int):
+        self.por_minuto = por_minuto
+        self._vezes = deque(maxlen=por_minuto)  # time.monotonic() das últimas chamadas
+        self._lock = threading.Lock()
+    def aguardar(self):
+        with self._lock:
+            if len(self._vezes) == self.por_minuto:
+                time.sleep(max(0.0, self._vezes[0] + 60 - time.monotonic()))
+            self._vezes.append(time.monotonic())
+
+@st.cache_resource
+def get_ritmo() -> Ritmo:
+    """Um Ritmo por processo: a cota é da chave, não do rerun."""
+    return Ritmo(RPM_TXT)
+
+# Cache em disco: seed fixa, então (prompt, aspect_ratio) determina a imagem
+@st.cache_data(persist="disk", show_spinner=False, max_entries=CACHE_IMG_RAM)
+def _replicate_cached(_rep, prompt: str, aspect_ratio: str) -> bytes:
+    #output = _rep.run("prunaai/flux.1-dev:970a966e3a5d8aa9a4bf13d395cf49c975dc4726e359f982fb833f9b100f75d5", input={"seed": -1, "prompt": prompt, "guidance": 3.5, "image_size": 1024, "speed_mode": "Juiced 🔥 (default)", "aspect_ratio": aspect_ratio, "output_format": "png", "output_quality": 100, "num_inference_steps": 30})
+    output = _rep.run(MODELO_IMG, input={"prompt": prompt, "aspect_ratio": aspect_ratio, "output_format": "png", "output_quality": 100, "seed":41270, "disable_safety_checker": True, "go_fast": False}) 
+    #output = _rep.run("minimax/image-01", input={"prompt": prompt, "aspect_ratio": aspect_ratio})
     return output[0].read()
     #return output.read()
 
+def gerar_imagem_replicate(rep, prompt: str, aspect_ratio: str="16:9", forcar: bool=False) -> bytes:
+    """Com `forcar` ("Forçar regeração"), descarta a entrada em disco antes de chamar."""
+    if forcar:
+        _replicate_cached.clear(rep, prompt, aspect_ratio)
+    return _replicate_cached(rep, prompt, aspect_ratio)
+
+def gerar_imagem(rep, prompt: str, limitador: Limitador, tries: int = 5, forcar: bool = False) -> bytes:
+    """gerar_imagem_replicate com nova tentativa (backoff) só nos 429; o resto propaga."""
+    for n in range(tries):
+        try:
+            with limitador:
+                img = gerar_imagem_replicate(rep, prompt, forcar=forcar)
+            limitador.sucesso(); return img
+        except Exception as e:
+            if not _e_limite(e) or n == tries-1: raise
+            limitador.estourou(espera(n, e))  # a próxima tentativa espera no __enter__
+
 # ─── Streamlit UI ───────────────────────────────
 st.set_page_config(page_title="SRT ▶︎ Replicate Imagens", layout="wide")
 st.title("🎞️ SRT → Gemini (prompt) → Replicate (imagem)")
@@ -103,86 +119,47 @@ rep_token = st.secrets.get("REPLICATE_API_TOKEN")
 if not rep_token:
     st.error("Defina REPLICATE_API_TOKEN em Settings → Secrets.")
     st.stop()
-os.environ["REPLICATE_API_TOKEN"] = rep_token
+rep = get_replicate(rep_token)
 api_key = st.secrets.get("GEMINI_API_KEY2","")
-client_txt = genai.Client(api_key=api_key) if api_key else None
+api_key_hash = hashlib.blake2b(api_key.encode()).hexdigest()[:16]
+client_txt = get_client(api_key) if api_key else None
 
 # Controles de bloco
 min_w = st.sidebar.number_input("Mín. palavras/bloco", 10, 100, 20)
 max_w = st.sidebar.number_input("Máx. palavras/bloco", 20, 150, 30)
-block_nums_str = st.sidebar.text_input("Blocos a (re)processar (índices, ex: 51,75):", "")
-timestamps_str = st.sidebar.text_area("Timestamps a (re)processar (uma por linha, sem .png):", "")
-selected_idxs = set()
-if block_nums_str.strip():
-    try:
-        selected_idxs = {int(x) for x in re.split(r"[,\s]+", block_nums_str) if x.strip()}
-    except ValueError:
-        st.error("Formato inválido em 'Blocos'. Use números separados por vírgula.")
-selected_ts = {line.strip() for line in timestamps_str.splitlines() if line.strip()}
+forcar = st.sidebar.checkbox("Forçar regeração (ignorar cache)", value=False)
+selected_idxs, selected_ts = filtros()
 uploaded = st.file_uploader("📂 Envie seu arquivo .srt", type="srt")
 
+prompts = Prompts(client_txt, MODELO_TXT, STYLE_SUFFIX, PEDIDO, PEDIDO_LOTE, api_key_hash, forcar, tries=1, ritmo=get_ritmo())
+pipeline = dict(
+    gerar_imagem=partial(gerar_imagem, rep, forcar=forcar), prontos=st.session_state["prompts"],
+    # sem GEMINI_API_KEY2: a legenda crua; com ela, refino falho cai em cena + STYLE_SUFFIX
+    direto=prompts.direto if client_txt else str, refinar=prompts.lote if client_txt else None,
+    forcar=forcar, nome="Replicate",
+)
+
+# Sessão nova (ou F5): última rodada deste app em disco
+app_dir = pasta_app("replicate", STYLE_SUFFIX, MODELO_TXT, MODELO_IMG)
+restaurar_rodada(app_dir)
+
 # ─── Botão: gerar tudo ───────────────────────────
 if st.button("🚀 Gerar Imagens"):
-    st.session_state["imgs"] = []
-    st.session_state["blocos"] = []
+    st.session_state["prompts"] = pipeline["prontos"] = {}
     if not uploaded:
         st.warning("Faça upload do .srt primeiro.")
         st.stop()
-    subs = pysrt.from_string(uploaded.getvalue().decode("utf-8"))
-    blocos = agrupar_blocos(subs, min_w, max_w)
-    st.session_state["blocos"] = blocos
-    st.info(f"{len(blocos)} blocos serão processados.")
-    prog = st.progress(0.0)
-    out_dir = Path("output_images"); out_dir.mkdir(exist_ok=True)
-
-    for i, blk in enumerate(blocos, 1):
-        key = f"{tag(blk['start'])}-{tag(blk['end'])}"
-        if selected_idxs and i not in selected_idxs: continue
-        if selected_ts and key not in selected_ts: continue
-        prompt = gerar_prompt(client_txt, blk["text"]) if client_txt else blk["text"]
-        try:
-            img_bytes = gerar_imagem_replicate(prompt)
-        except Exception as e:
-            st.warning(f"Bloco {i} ({key}) falhou: {e}")
-            prog.progress(i/len(blocos)); continue
-
-        name = f"{key}_B{i}.png"
-        (out_dir/name).write_bytes(img_bytes)
-        st.session_state["imgs"].append({"name":name,"bytes":img_bytes,"prompt":prompt})
-        prog.progress(i/len(blocos))
+    blocos = nova_rodada(app_dir, uploaded, min_w, max_w, bool(client_txt))
+    st.info(f"{len(blocos)} blocos.")
+    rodar(selecionar(blocos, selected_idxs, selected_ts), st.progress(0.0), **pipeline)
     st.success("✔️ Imagens geradas!")
 
 # ─── Botão: reprocessar falhas ───────────────────
 if st.session_state["blocos"] and st.button("🔄 Reprocessar blocos falhos"):
     prog = st.progress(0.0)
-    for i, blk in enumerate(st.session_state["blocos"], 1):
-        key = f"{tag(blk['start'])}-{tag(blk['end'])}"
-        if any(item["name"] == f"{key}_B{i}.png" for item in st.session_state["imgs"]): continue
-        if selected_idxs and i not in selected_idxs: continue
-        if selected_ts and key not in selected_ts: continue
-        prompt = gerar_prompt(client_txt, blk["text"]) if client_txt else blk["text"]
-        try:
-            img_bytes = gerar_imagem_replicate(prompt)
-        except Exception as e:
-            st.warning(f"Retry {i} ({key}) falhou: {e}"); prog.progress(i/len(st.session_state["blocos"])); continue
-
-        name = f"{key}_B{i}.png"
-        st.session_state["imgs"].append({"name":name,"bytes":img_bytes,"prompt":prompt})
-        prog.progress(i/len(st.session_state["blocos"]))
+    feitos = {item["name"] for item in st.session_state["imgs"]}
+    rodar(selecionar(st.session_state["blocos"], selected_idxs, selected_ts, feitos), prog, **pipeline)
     st.success("🔄 Reprocessamento concluído!")
 
 # ─── Galeria + downloads ────────────────────────
-if st.session_state["imgs"]:
-    st.header("📸 Galeria de Imagens")
-    for idx,item in enumerate(st.session_state["imgs"]):
-        st.image(item["bytes"], caption=item["name"], use_column_width=True)
-        st.download_button(f"Baixar {item['name']}", item["bytes"], file_name=item["name"], mime="image/png", key=f"img-{idx}")
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf,"w",zipfile.ZIP_DEFLATED) as zf:
-        for item in st.session_state["imgs"]:
-            zf.writestr(item["name"], item["bytes"])
-    buf.seek(0)
-    st.download_button("⬇️ Baixar ZIP (.zip)", buf, "output_images.zip", "application/zip")
-
-    txt = "\n\n".join(f"{itm['name']}: {itm['prompt']}" for itm in st.session_state["imgs"])
-    st.download_button("⬇️ Baixar Prompts (.txt)", txt, "prompts.txt", "text/plain")
+galeria("📸 Galeria de Imagens", "⬇️ Baixar ZIP (.zip)", "output_images.zip")
@@ -0,0 +1,845 @@
+"""
+Núcleo comum aos front-ends Streamlit (SRTPlay.py, SRTPlay2, SRTPlayMini.py)
+---------------------------------------------------------------------------
+• Agrupamento das legendas em blocos e nomes de arquivo por timestamp.
+• Gravação dos PNGs em disco (em segundo plano) e reconstrução da galeria.
+• Limpeza do prompt devolvido pelo modelo de texto.
+• Backoff / Limitador para os 429 (Gemini e Replicate).
+• Pipeline SRT → prompt → imagem: clients, cache em disco, retry e lotes.
+• A página inteira das variantes só-Gemini (app_gemini) e as peças de UI
+  (filtros, galeria) que o SRTPlayMini também usa.
+SRTPlay.py/SRTPlay2 só passam a configuração (modelos, STYLE_SUFFIX, pedidos);
+o SRTPlayMini acrescenta a geração de imagem no Replicate.
+"""
+from __future__ import annotations
+import os, re, time, hashlib, random, threading, json, asyncio, tempfile, zipfile, shutil
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import timedelta
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, List
+
+import httpx
+import numpy as np
+import streamlit as st
+import srt
+import google.genai as genai
+from google.genai import types
+from PIL import Image
+
+BACKOFF_MAX = 30.0    # teto (s) da espera entre tentativas
+MAX_CONCORRENCIA = 5  # imagens simultâneas (Gemini ou Replicate)
+TIMEOUT_MS = 60_000   # timeout HTTP dos clients Gemini
+LOTE_PROMPTS = 16     # cenas por chamada ao modelo de texto
+MODELO_EMBED = "text-embedding-004"
+LIMIAR_SEMANTICO = 0.92  # cosseno a partir do qual dois prompts dividem a imagem
+# Caches de imagem com persist="disk": Streamlit põe na frente uma camada em
+# memória (por processo, entre sessões) com até max_entries PNGs inteiros. O
+# disco continua com todas as entradas; em RAM ficam só as últimas.
+CACHE_IMG_RAM = 2 * MAX_CONCORRENCIA
+
+
+# ─── Blocos e nomes ────────────────────────────
+@lru_cache(maxsize=8192)  # chamada a cada bloco em todo rerun/reprocesso
+def tag(t: timedelta) -> str:
+    ms = t // timedelta(milliseconds=1)
+    s, ms = divmod(ms, 1000)
+    m, s = divmod(s, 60)
+    h, m = divmod(m, 60)
+    return f"{h:02d}_{m:02d}_{s:02d}_{ms:03d}"
+
+def agrupar_blocos(subs: List[srt.Subtitle], min_w=20, max_w=30):
+    # Achata as palavras uma vez; cum[k] = total de palavras até a legenda k
+    all_words, cum, itens = [], [], []
+    for s in subs:
+        words = s.content.split()  # split() já trata \n e qualquer espaço
+        if not words:
+            continue
+        all_words.extend(words)
+        cum.append(len(all_words))
+        itens.append(s)
+
+    blocos, k, base = [], 0, 0
+    while k < len(itens):
+        # primeira legenda em que o bloco atinge min_w palavras
+        j = bisect_left(cum, base + min_w, k)
+        if j == len(itens):
+            break
+        blocos.append({
+            "start": itens[k].start,
+            "end": itens[j].end,
+            "text": " ".join(all_words[base:min(base + max_w, cum[j])])
+        })
+        base, k = cum[j], j + 1
+    if base < len(all_words):
+        blocos.append({
+            "start": itens[k].start,
+            "end": subs[-1].end,
+            "text": " ".join(all_words[base:])
+        })
+    return blocos
+
+
+@st.cache_data(show_spinner=False, max_entries=20)
+def blocos_do_srt(raw: bytes, min_w: int, max_w: int) -> list[dict]:
+    """Parse + agrupamento, memorizados pelo conteúdo do .srt e pelos limites."""
+    subs = list(srt.parse(raw.decode("utf-8"), ignore_errors=True))
+    return agrupar_blocos(subs, min_w, max_w)
+
+
+# ─── Disco e galeria ───────────────────────────
+def gravar_png(path: Path, img_bytes: bytes, prompt: str, gravados: dict) -> None:
+    """Grava o PNG e, ao lado, `<nome>.prompt.txt`; bytes idênticos a um já
+    gravado nesta rodada (prompt repetido) viram hardlink, ocupando o disco uma vez só."""
+    path.with_suffix(".prompt.txt").write_text(prompt, encoding="utf-8")
+    h = hashlib.blake2b(img_bytes, digest_size=16).digest()
+    path.unlink(missing_ok=True)  # nunca escrever através de um link antigo
+    if h in gravados:
+        try:
+            os.link(gravados[h], path)
+            return
+        except OSError:
+            pass  # FS sem hardlink: cópia normal
+    path.write_bytes(img_bytes)
+    gravados[h] = path
+
+
+def copiar_png(origem: Path, path: Path, prompt: str) -> None:
+    """`path` com a mesma imagem de `origem`, já gravado: hardlink, ou cópia se o FS não tiver."""
+    path.with_suffix(".prompt.txt").write_text(prompt, encoding="utf-8")
+    path.unlink(missing_ok=True)
+    try:
+        os.link(origem, path)
+    except OSError:
+        shutil.copyfile(origem, path)
+
+
+class Gravador:
+    """Fila de gravações numa thread própria: as requisições seguem enquanto
+    cada PNG que chega vai para o disco. Uma thread só mantém
+    `gravados` (hardlink dos repetidos) sem lock; sair do `with` espera a fila
+    e repassa o primeiro erro de disco, em vez de perdê-lo na thread."""
+
+    def __init__(self):
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="srtplay-disco")
+        self._futs = []
+        self.gravados = {}
+
+    def __enter__(self):
+        return self
+
+    def gravar(self, path: Path, img_bytes: bytes, prompt: str) -> None:
+        self._futs.append(self._pool.submit(gravar_png, path, img_bytes, prompt, self.gravados))
+
+    def copiar(self, origem: Path, path: Path, prompt: str) -> None:
+        """Mesma fila, então `origem` já está gravado quando a cópia roda."""
+        self._futs.append(self._pool.submit(copiar_png, origem, path, prompt))
+
+    def __exit__(self, *exc):
+        self._pool.shutdown(wait=True)
+        for fut in self._futs:
+            fut.result()
+
+
+def _n_bloco(nome: str) -> int:
+    """Número do bloco em `<key>_B<n>.png` (-1 se o nome não seguir o padrão)."""
+    n = Path(nome).stem.rsplit("_B", 1)[-1]
+    return int(n) if n.isdigit() else -1
+
+
+def _mtime(p: Path) -> int:
+    try:
+        return p.stat().st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def imgs_do_disco(out_dir: Path) -> list[dict]:
+    """Galeria reconstruída dos PNGs já gravados em `out_dir` (uma rodada),
+    na ordem dos blocos. Só decodifica de novo quando algum arquivo muda."""
+    pngs = sorted((p for p in out_dir.glob("*_B*.png") if _n_bloco(p.name) >= 0), key=lambda p: _n_bloco(p.name))
+    return _imgs_cached(tuple((str(p), _mtime(p), _mtime(p.with_suffix(".prompt.txt"))) for p in pngs))
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _imgs_cached(arquivos: tuple[tuple[str, int, int], ...]) -> list[dict]:
+    # chave: (caminho, mtime do PNG, mtime do .prompt.txt) de cada arquivo
+    itens = []
+    for path, _, _ in arquivos:
+        p = Path(path)
+        t = p.with_suffix(".prompt.txt")
+        itens.append({
+            "name": p.name,
+            "path": path,
+            "thumb": miniatura(p.read_bytes()),
+            "prompt": t.read_text(encoding="utf-8") if t.exists() else "",
+        })
+    return itens
+
+
+# Uma pasta por app e, dentro dela, uma por upload:
+# output_images/<app>-<hash de estilo + modelos>/<nome do .srt>-<hash de conteúdo + limites + opções>/,
+# com blocos.json ao lado dos PNGs para o Reprocessar sobreviver ao F5.
+SAIDA = Path("output_images")
+_NOME_SEGURO = re.compile(r"[^\w.-]+")
+
+
+def _hash(*partes) -> str:
+    return hashlib.blake2b("|".join(map(str, partes)).encode(), digest_size=6).hexdigest()
+
+
+def pasta_app(nome: str, *identidade) -> Path:
+    """Pasta das rodadas de um app; `identidade` (estilo, modelos) separa
+    SRTPlay, SRTPlay2 e Mini mesmo com o mesmo .srt."""
+    return SAIDA / f"{nome}-{_hash(*identidade)}"
+
+
+def pasta_rodada(app_dir: Path, nome: str, raw: bytes, min_w: int, max_w: int, *opcoes) -> Path:
+    h = _hash(hashlib.blake2b(raw).hexdigest(), min_w, max_w, *opcoes)
+    return app_dir / f"{_NOME_SEGURO.sub('_', Path(nome).stem)}-{h}"
+
+
+def salvar_blocos(out_dir: Path, blocos: list[dict]) -> None:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / "blocos.json").write_text(json.dumps([
+        {"start": b["start"] // timedelta(microseconds=1), "end": b["end"] // timedelta(microseconds=1), "text": b["text"]}
+        for b in blocos
+    ], ensure_ascii=False), encoding="utf-8")
+
+
+def ler_blocos(path: Path) -> list[dict]:
+    return [
+        {"start": timedelta(microseconds=b["start"]), "end": timedelta(microseconds=b["end"]), "text": b["text"]}
+        for b in json.loads(path.read_text(encoding="utf-8"))
+    ]
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def prompts_txt(itens: tuple[tuple[str, str], ...]) -> str:
+    """Conteúdo do prompts.txt; só remonta quando a lista (nome, prompt) muda."""
+    return "\n\n".join(f"{nome}: {prompt}" for nome, prompt in itens)
+
+
+def miniatura(img_bytes: bytes, size=(960, 540)) -> bytes:
+    """WEBP reduzido só para a galeria; o PNG original segue para os downloads."""
+    thumb = Image.open(BytesIO(img_bytes))
+    thumb.thumbnail(size, Image.LANCZOS)
+    buf = BytesIO()
+    thumb.save(buf, "WEBP", quality=80, method=0)  # method=0: encoder mais rápido, tamanho ~igual
+    return buf.getvalue()
+
+
+# ─── Prompt ────────────────────────────────────
+_PROMPT_HDR = re.compile(r"\*{0,2}Prompt\*{0,2}:\s*")
+_HERES = re.compile(r"^Here(?:'|’)s a [^:]+:\s*")
+_ESPACOS = re.compile(r"\s+")
+
+
+def clean_prompt(raw: str) -> str:
+    parts = _PROMPT_HDR.split(raw)
+    body = parts[-1] if len(parts) > 1 else raw
+    body = _HERES.sub("", body)
+    body = body.replace("*", "").strip()
+    return _ESPACOS.sub(" ", body)
+
+
+# ─── 429: backoff e concorrência adaptativa ────
+def _e_limite(e: Exception) -> bool:
+    """429 do Replicate (status) ou do Gemini (code / RESOURCE_EXHAUSTED)."""
+    return 429 in (getattr(e, "status", None), getattr(e, "code", None)) or "RESOURCE_EXHAUSTED" in str(e)
+
+
+# Gemini: RetryInfo.retryDelay "37s"; Replicate: "Expected available in 6 seconds."
+_RETRY_DELAY = re.compile(r"retryDelay['\"]?\s*:\s*['\"]?(\d+(?:\.\d+)?)s|available in (\d+(?:\.\d+)?) second")
+
+
+def _retry_after(e: Exception) -> float | None:
+    """Espera pedida pela própria API: header Retry-After ou o prazo citado no corpo do erro."""
+    resp = getattr(e, "response", None)
+    valor = getattr(resp, "headers", {}).get("Retry-After")
+    if valor is None and (m := _RETRY_DELAY.search(str(getattr(e, "details", None) or e))):
+        valor = m.group(1) or m.group(2)
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None  # ausente ou no formato data HTTP
+
+
+def espera(tentativa: int, e: Exception | None = None) -> float:
+    """Quanto esperar após um 429: o Retry-After da API (+ jitter) se houver,
+    senão backoff exponencial com jitter em [0, min(BACKOFF_MAX, 2·2ⁿ)] s."""
+    if e is not None and (pedido := _retry_after(e)) is not None:
+        return pedido + random.uniform(0, 0.5)
+    return random.uniform(0, min(BACKOFF_MAX, 2.0 * 2 ** min(tentativa, 8)))
+
+
+class Limitador:
+    """Concorrência adaptativa entre as threads do pool: o limite cai pela
+    metade a cada 429 e volta a subir (+1) após SUBIR_APOS sucessos seguidos.
+    Um 429 também pausa todas as threads, e não só a que o recebeu."""
+    SUBIR_APOS = 10
+
+    def __init__(self, maximo: int):
+        self.maximo = self.limite = maximo
+        self.ativos = self.sucessos = self.reducoes = 0
+        self.pausa_ate = 0.0  # time.monotonic() até quando ninguém chama a API
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while True:
+                resta = self.pausa_ate - time.monotonic()
+                if resta > 0:
+                    self._cond.wait(resta)
+                elif self.ativos >= self.limite:
+                    self._cond.wait()
+                else:
+                    break
+            self.ativos += 1
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self.ativos -= 1
+            self._cond.notify_all()
+
+    def sucesso(self):
+        with self._cond:
+            self.sucessos += 1
+            if self.sucessos >= self.SUBIR_APOS and self.limite < self.maximo:
+                self.limite += 1
+                self.sucessos = 0
+                self._cond.notify_all()
+
+    def estourou(self, pausa: float):
+        with self._cond:
+            self.sucessos = 0
+            self.pausa_ate = max(self.pausa_ate, time.monotonic() + pausa)
+            if self.limite > 1:
+                self.limite //= 2
+                self.reducoes += 1
+
+
+# ─── Gemini: clients, cache em disco e retry ───
+@st.cache_resource
+def get_clients(api_key: str, api_version_img: str = "v1alpha") -> tuple[genai.Client, genai.Client]:
+    """Clients de texto e imagem, criados uma vez e reaproveitados entre reruns.
+    Os dois falam com o mesmo host, então dividem um único pool httpx: as
+    conexões TLS abertas por um servem ao outro."""
+    http = httpx.Client(
+        timeout=TIMEOUT_MS / 1000,
+        limits=httpx.Limits(max_connections=4 * MAX_CONCORRENCIA, max_keepalive_connections=2 * MAX_CONCORRENCIA),
+    )
+    return (
+        genai.Client(api_key=api_key, http_options=types.HttpOptions(timeout=TIMEOUT_MS, httpx_client=http)),
+        genai.Client(api_key=api_key, http_options=types.HttpOptions(api_version=api_version_img, timeout=TIMEOUT_MS, httpx_client=http)),
+    )
+
+
+@st.cache_resource
+def get_pool() -> ThreadPoolExecutor:
+    """Threads das chamadas síncronas de imagem (e embedding), reaproveitadas
+    entre reruns. O modelo de texto roda à parte, em processar_blocos."""
+    return ThreadPoolExecutor(max_workers=MAX_CONCORRENCIA, thread_name_prefix="srtplay")
+
+
+# Cache em disco: (modelo, pedido) determina a resposta; falhas levantam e não
+# são cacheadas. Client e Ritmo (prefixo "_") ficam fora da chave de hash.
+@st.cache_data(persist="disk", show_spinner=False, max_entries=1000)
+def _gemini_texto_cached(_client_txt, pedido: str, model: str, api_key_hash: str,
+                         lista_json: bool = False, _ritmo=None) -> str:
+    if _ritmo:
+        _ritmo.aguardar()  # acertos do cache não gastam cota nem esperam
+    # lista_json: saída estruturada, um array JSON de strings
+    config = types.GenerateContentConfig(
+        response_mime_type="application/json", response_schema=list[str]
+    ) if lista_json else None
+    resp = _client_txt.models.generate_content(model=model, contents=pedido, config=config)
+    raw = resp.candidates[0].content.parts[0].text
+    if not raw:
+        raise ValueError("resposta de texto vazia")
+    return raw
+
+
+class SemImagem(Exception):
+    """O modelo respondeu, mas sem imagem nas parts."""
+
+
+class Bloqueado(Exception):
+    """O prompt foi recusado (filtro de segurança etc.): tentar de novo não adianta."""
+
+
+_BLOQUEIOS = {"SAFETY", "PROHIBITED_CONTENT", "BLOCKLIST", "SPII", "IMAGE_SAFETY", "IMAGE_PROHIBITED_CONTENT"}
+
+
+def _definitivo(e: Exception) -> bool:
+    """Falhas permanentes: prompt bloqueado, pedido inválido, chave sem acesso."""
+    return isinstance(e, Bloqueado) or (
+        isinstance(e, genai.errors.ClientError) and e.code in (400, 401, 403, 404)
+    )
+
+
+def _retry(fn, tries: int, limitador: Limitador | None = None, pausa: float = 2.0):
+    """fn() com até `tries` tentativas; devolve None se nenhuma der certo.
+    429 → espera(n, e), pausando todo o `limitador` se houver um; qualquer
+    erro transitório (inclusive SemImagem) → `pausa` s e tenta de novo;
+    erro definitivo (_definitivo) → desiste na hora."""
+    for n in range(tries):
+        try:
+            with limitador or nullcontext():
+                r = fn()
+            if limitador:
+                limitador.sucesso()
+            return r
+        except Exception as e:
+            if _definitivo(e):
+                return None
+            if _e_limite(e) and limitador:
+                limitador.estourou(espera(n, e))  # a próxima tentativa espera no __enter__
+            elif n < tries - 1:
+                time.sleep(espera(n, e) if _e_limite(e) else pausa)
+    return None
+
+
+class Prompts:
+    """Cena → prompt de imagem pelo modelo de texto. Cada script só passa o
+    pedido: `pedido` usa {cena} e {estilo}; `pedido_lote`, {n}, {cenas} e {estilo}.
+    Com `forcar`, a entrada em disco é descartada antes de chamar; com `ritmo`,
+    cada chamada de verdade espera a cota por minuto."""
+
+    def __init__(self, client_txt, modelo: str, estilo: str, pedido: str, pedido_lote: str,
+                 api_key_hash: str, forcar: bool = False, tries: int = 2, ritmo=None):
+        self.client_txt, self.modelo, self.estilo = client_txt, modelo, estilo
+        self.pedido, self.pedido_lote = pedido, pedido_lote
+        self.api_key_hash, self.forcar, self.tries, self.ritmo = api_key_hash, forcar, tries, ritmo
+
+    def direto(self, texto: str) -> str:
+        """Prompt sem passar pelo modelo de texto: a cena + o estilo."""
+        return f"{texto}, {self.estilo}"
+
+    def _texto(self, pedido: str, lista_json: bool = False) -> str:
+        args = (self.client_txt, pedido, self.modelo, self.api_key_hash, lista_json)
+        if self.forcar:
+            _gemini_texto_cached.clear(*args)
+        return _gemini_texto_cached(*args, _ritmo=self.ritmo)
+
+    def um(self, texto: str) -> str | None:
+        """Prompt refinado da cena, ou None se o modelo não deu um utilizável
+        (quem chama decide o fallback, normalmente `direto`)."""
+        pedido = self.pedido.format(cena=texto, estilo=self.estilo)
+        if raw := _retry(lambda: self._texto(pedido), self.tries):
+            prompt = clean_prompt(raw)
+            if prompt and not prompt.startswith(texto[:10]):
+                return prompt
+        return None
+
+    def lote(self, textos: list[str]) -> list[str | None]:
+        """Como `um`, mas várias cenas num único pedido (uma vez o RPM em vez de N).
+        Se o array devolvido não tiver um prompt por cena, refaz cena a cena; se
+        a chamada em si falhar (429, pedido recusado, erro persistente), o lote
+        inteiro fica sem refino (None), sem multiplicar o pedido numa cota já esgotada."""
+        if len(textos) == 1:
+            return [self.um(textos[0])]
+        pedido = self.pedido_lote.format(
+            n=len(textos), cenas=json.dumps(textos, ensure_ascii=False), estilo=self.estilo
+        )
+        raw = _retry(lambda: self._texto(pedido, lista_json=True), self.tries)
+        if raw is None:
+            return [None] * len(textos)
+        try:
+            itens = json.loads(raw)
+        except ValueError:
+            itens = None
+        if isinstance(itens, list) and len(itens) == len(textos):
+            return [
+                p if (p := clean_prompt(str(bruto))) and not p.startswith(t[:10]) else None
+                for bruto, t in zip(itens, textos)
+            ]
+        return [self.um(t) for t in textos]
+
+
+@st.cache_data(persist="disk", show_spinner=False, max_entries=CACHE_IMG_RAM)
+def _gemini_imagem_cached(_client_img, prompt: str, model: str, api_key_hash: str) -> bytes:
+    resp = _client_img.models.generate_content(
+        model=model,
+        contents=[prompt],
+        config=types.GenerateContentConfig(response_modalities=["TEXT", "IMAGE"])
+    )
+    if resp and resp.prompt_feedback and resp.prompt_feedback.block_reason:
+        raise Bloqueado(resp.prompt_feedback.block_reason)
+    if resp and resp.candidates:
+        cand0 = resp.candidates[0]
+        if cand0.content and getattr(cand0.content, "parts", None):
+            for part in cand0.content.parts:
+                if part.inline_data:
+                    return part.inline_data.data
+        if getattr(cand0.finish_reason, "name", None) in _BLOQUEIOS:
+            raise Bloqueado(cand0.finish_reason.name)
+    raise SemImagem(prompt)
+
+
+@st.cache_data(persist="disk", show_spinner=False, max_entries=5000)
+def _embedding_cached(_client_txt, texto: str, model: str, api_key_hash: str) -> list[float]:
+    resp = _client_txt.models.embed_content(model=model, contents=texto)
+    return list(resp.embeddings[0].values)
+
+
+class IndiceSemantico:
+    """Prompts já mandados ao modelo de imagem + seus embeddings normalizados."""
+
+    def __init__(self):
+        self.prompts: list[str] = []
+        self.vetores = np.empty((0, 0), dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def equivalente(self, prompt: str, vetor) -> str:
+        """Prompt já indexado com cosseno >= LIMIAR_SEMANTICO; se não houver,
+        indexa `prompt` e devolve ele mesmo."""
+        v = np.asarray(vetor, dtype=np.float32)
+        v /= np.linalg.norm(v) or 1.0
+        with self._lock:
+            if self.prompts:
+                sims = self.vetores @ v
+                k = int(sims.argmax())
+                if sims[k] >= LIMIAR_SEMANTICO:
+                    return self.prompts[k]
+                self.vetores = np.vstack([self.vetores, v])
+            else:
+                self.vetores = v[None, :]
+            self.prompts.append(prompt)
+        return prompt
+
+
+@st.cache_resource
+def get_indice(api_key_hash: str) -> IndiceSemantico:
+    """Um índice por chave, vivo entre reruns; as imagens em si ficam no cache em disco."""
+    return IndiceSemantico()
+
+
+class ImagensGemini:
+    """Prompt → PNG pelo modelo de imagem do Gemini, com `tries` tentativas e
+    `pausa` s entre erros transitórios; `forcar` como em Prompts."""
+
+    def __init__(self, client_txt, client_img, modelo: str, api_key_hash: str,
+                 forcar: bool = False, tries: int = 2, pausa: float = 1.5):
+        self.client_txt, self.client_img, self.modelo = client_txt, client_img, modelo
+        self.api_key_hash, self.forcar, self.tries, self.pausa = api_key_hash, forcar, tries, pausa
+        self.sem_embedding: Exception | None = None  # falha não passageira: reaproveitamento desligado
+        self.falhas_embedding = 0                    # prompts que ficaram sem embedding por 429/5xx/rede
+        self._lock = threading.Lock()
+
+    def _imagem(self, prompt: str) -> bytes:
+        args = (self.client_img, prompt, self.modelo, self.api_key_hash)
+        if self.forcar:
+            _gemini_imagem_cached.clear(*args)
+        return _gemini_imagem_cached(*args)
+
+    def gerar(self, prompt: str, limitador: Limitador) -> bytes | None:
+        return _retry(lambda: self._imagem(prompt), self.tries, limitador, self.pausa)
+
+    def equivalente(self, prompt: str) -> str:
+        """Prompt já gerado quase igual a `prompt` (cena parafraseada), ou ele mesmo.
+        Falha passageira (429, 5xx, rede) só pula este prompt; qualquer outra
+        (MODELO_EMBED inexistente, chave sem acesso...) desliga o reaproveitamento
+        no resto da rodada. As duas ficam registradas para a página avisar."""
+        if self.sem_embedding:
+            return prompt
+        try:
+            vetor = _embedding_cached(self.client_txt, prompt, MODELO_EMBED, self.api_key_hash)
+        except Exception as e:
+            if _e_limite(e) or isinstance(e, (genai.errors.ServerError, httpx.TransportError)):
+                with self._lock:
+                    self.falhas_embedding += 1
+            else:
+                self.sem_embedding = e
+            return prompt
+        return get_indice(self.api_key_hash).equivalente(prompt, vetor)
+
+
+# ─── Pipeline por bloco ────────────────────────
+async def processar_blocos(work, prog, out_dir: Path, gerar_imagem: Callable, direto: Callable[[str], str], prontos: dict,
+                           refinar: Callable[[list[str]], list[str]] | None = None,
+                           equivalente: Callable[[str], str] | None = None, forcar: bool = False,
+                           nome: str = "Gemini") -> list:
+    """Gera prompt + imagem de cada (i, blk, key) em `work`, até MAX_CONCORRENCIA
+    imagens em paralelo. Com `refinar` (ex.: Prompts.lote), os prompts saem em
+    lotes de LOTE_PROMPTS cenas, um lote por vez; sem ele, ou onde ele devolver
+    None, `direto(texto)`.
+    `prontos` (key → prompt) é lido e completado: quem já tem prompt refinado
+    não volta ao modelo de texto (a não ser com `forcar`).
+    `gerar_imagem(prompt, limitador)` devolve os bytes ou None, ou levanta.
+    Cada PNG vai para a fila do Gravador assim que chega, enquanto as outras
+    requisições seguem. Devolve, na ordem de `work`, o item da galeria
+    ({"name","path","thumb","prompt"}), None (sem imagem) ou a Exception."""
+    loop, pool = asyncio.get_running_loop(), get_pool()
+    sem = asyncio.Semaphore(MAX_CONCORRENCIA)
+    limitador = Limitador(MAX_CONCORRENCIA)  # encolhe nos 429 do modelo de imagem
+    resultados = [None] * len(work)
+    imagens = {}  # prompt → task; prompts repetidos (refrões) geram uma imagem só
+    feitos = 0
+
+    async def gerar(prompt, destino, proprio):
+        # os bytes só vivem aqui e na fila do Gravador: a task guarda (path, miniatura)
+        img_bytes = await loop.run_in_executor(pool, gerar_imagem, prompt, limitador)
+        if img_bytes is None:
+            return None
+        disco.gravar(destino, img_bytes, proprio)
+        return destino, await asyncio.to_thread(miniatura, img_bytes)
+
+    async def imagem(prompt, destino, proprio):
+        if prompt not in imagens:
+            imagens[prompt] = asyncio.ensure_future(gerar(prompt, destino, proprio))
+        return await imagens[prompt]
+
+    async def imagem_semantica(prompt, destino):
+        # prompt quase igual a um já gerado (cena parafraseada) → mesma imagem
+        alvo = await loop.run_in_executor(pool, equivalente, prompt)
+        feito = await imagem(alvo, destino, prompt)
+        if feito is None and alvo != prompt:
+            feito = await imagem(prompt, destino, prompt)
+        return feito
+
+    async def process(pos, prompt):
+        nonlocal feitos
+        i, _, key = work[pos]
+        fname = f"{key}_B{i}.png"  # inclui número do bloco no nome do arquivo
+        destino = out_dir/fname
+        async with sem:
+            try:
+                feito = await (imagem_semantica(prompt, destino) if equivalente else imagem(prompt, destino, prompt))
+            except Exception as e:
+                feito = e
+        if isinstance(feito, tuple):
+            origem, thumb = feito
+            if origem != destino:
+                disco.copiar(origem, destino, prompt)  # imagem de outro bloco: link em disco, sem bytes em RAM
+            resultados[pos] = {"name": fname, "path": str(destino), "thumb": thumb, "prompt": prompt}
+        else:
+            resultados[pos] = feito
+        feitos += 1
+        prog.progress(feitos/len(work))
+
+    async def produzir(texto):
+        # Um lote de texto por vez, numa thread só dele: a espera do Ritmo (cota
+        # por minuto) não prende threads do pool, e as imagens do lote anterior
+        # já estão rodando enquanto o próximo é refinado.
+        tarefas = []
+        for inicio in range(0, len(work), LOTE_PROMPTS):
+            posicoes = range(inicio, min(inicio + LOTE_PROMPTS, len(work)))
+            if refinar:
+                novos = [pos for pos in posicoes if forcar or work[pos][2] not in prontos]
+                if novos:
+                    gerados = await loop.run_in_executor(texto, refinar, [work[pos][1]["text"] for pos in novos])
+                    # só o que veio mesmo do modelo de texto; o fallback volta a tentar no próximo reprocesso
+                    prontos.update((work[pos][2], p) for pos, p in zip(novos, gerados) if p)
+                prompts = [prontos.get(work[pos][2]) or direto(work[pos][1]["text"]) for pos in posicoes]
+            else:
+                prompts = [direto(work[pos][1]["text"]) for pos in posicoes]
+            tarefas += [asyncio.ensure_future(process(pos, p)) for pos, p in zip(posicoes, prompts)]
+        await asyncio.gather(*tarefas)
+
+    with Gravador() as disco, ThreadPoolExecutor(max_workers=1, thread_name_prefix="srtplay-texto") as texto:
+        await produzir(texto)  # sair do with espera a fila de gravações
+    if limitador.reducoes:
+        st.toast(f"⏳ Limite de taxa do {nome}: concorrência ajustada para {limitador.limite}.")
+    return resultados
+
+
+# ─── UI ────────────────────────────────────────
+def iniciar_sessao() -> None:
+    if "imgs" not in st.session_state:
+        st.session_state["imgs"] = []    # [{"name","path","thumb","prompt"}]; o PNG fica só em disco
+    if "blocos" not in st.session_state:
+        st.session_state["blocos"] = []  # guarda blocos para reprocessar
+    if "prompts" not in st.session_state:
+        st.session_state["prompts"] = {}  # key → prompt vindo do modelo de texto (nunca o fallback), mesmo se a imagem falhou
+    if "out_dir" not in st.session_state:
+        st.session_state["out_dir"] = ""  # pasta da rodada atual (pasta_rodada)
+
+
+def restaurar_rodada(app_dir: Path) -> None:
+    """Sessão nova (ou F5): volta à última rodada gravada deste app, com blocos
+    (o Reprocessar continua disponível) e galeria só dela."""
+    if st.session_state["blocos"]:
+        return
+    rodadas = list(app_dir.glob("*/blocos.json"))
+    if not rodadas:
+        return
+    ultima = max(rodadas, key=_mtime)
+    st.session_state["out_dir"] = str(ultima.parent)
+    st.session_state["blocos"] = ler_blocos(ultima)
+    st.session_state["imgs"] = imgs_do_disco(ultima.parent)
+
+
+def nova_rodada(app_dir: Path, uploaded, min_w: int, max_w: int, *opcoes) -> list[dict]:
+    """Blocos do .srt enviado, gravados na pasta da rodada (`opcoes` entram no
+    hash dela); a galeria recomeça vazia, como o Gerar sempre fez."""
+    raw = uploaded.getvalue()
+    blocos = blocos_do_srt(raw, min_w, max_w)
+    out_dir = pasta_rodada(app_dir, uploaded.name, raw, min_w, max_w, *opcoes)
+    salvar_blocos(out_dir, blocos)  # também a marca como a rodada mais recente
+    st.session_state["out_dir"] = str(out_dir)
+    st.session_state["blocos"] = blocos
+    st.session_state["imgs"] = []
+    return blocos
+
+
+def filtros() -> tuple[set[int], set[str]]:
+    """Blocos (índices) e timestamps a (re)processar, da sidebar."""
+    block_nums_str = st.sidebar.text_input("Blocos a (re)processar (índices, ex: 51,75):", "")
+    timestamps_str = st.sidebar.text_area("Timestamps a (re)processar (uma por linha, sem .png):", "")
+    selected_idxs = set()
+    if block_nums_str.strip():
+        try:
+            selected_idxs = {int(x) for x in re.split(r"[,\s]+", block_nums_str) if x.strip()}
+        except ValueError:
+            st.error("Formato inválido em 'Blocos'. Use números separados por vírgula.")
+    selected_ts = {line.strip() for line in timestamps_str.splitlines() if line.strip()}
+    return selected_idxs, selected_ts
+
+
+def selecionar(blocos, selected_idxs: set[int], selected_ts: set[str], feitos=frozenset()) -> list:
+    """[(i, blk, key)] dos blocos que passam nos filtros e ainda não estão em `feitos` (nomes de PNG)."""
+    work = []
+    for i, blk in enumerate(blocos, 1):
+        if selected_idxs and i not in selected_idxs:
+            continue  # antes do tag(): só os blocos escolhidos montam a chave
+        key = f"{tag(blk['start'])}-{tag(blk['end'])}"
+        if f"{key}_B{i}.png" in feitos:
+            continue
+        if selected_ts and key not in selected_ts:
+            continue
+        work.append((i, blk, key))
+    return work
+
+
+def rodar(work, prog, **pipeline) -> None:
+    """processar_blocos(work, prog, ...) na pasta da rodada atual e a galeria
+    com o que saiu (substituindo o que foi refeito); blocos sem imagem viram um aviso."""
+    out_dir = Path(st.session_state["out_dir"]); out_dir.mkdir(parents=True, exist_ok=True)
+    resultados = asyncio.run(processar_blocos(work, prog, out_dir, **pipeline))
+    imgs = {item["name"]: item for item in st.session_state["imgs"]}
+    for (i, blk, key), item in zip(work, resultados):
+        if isinstance(item, Exception):
+            st.warning(f"⚠️ Bloco {i} ({key}) falhou: {item}")
+        elif item is None:
+            st.warning(f"⚠️ Bloco {i} ({key}): sem imagem, pulado.")
+        else:
+            imgs[item["name"]] = item
+    st.session_state["imgs"] = sorted(imgs.values(), key=lambda item: _n_bloco(item["name"]))
+
+
+def montar_zip(itens: tuple[tuple[str, str], ...]) -> bytes:
+    """ZIP dos PNGs (caminho, nome), direto do disco, um por vez, num arquivo
+    temporário. PNG já é comprimido, então ZIP_STORED (sem deflate) dá o mesmo
+    tamanho sem gastar CPU."""
+    with tempfile.TemporaryFile() as tmp:
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_STORED) as zf:
+            for path, nome in itens:
+                zf.write(path, arcname=nome)
+        tmp.seek(0)
+        return tmp.read()
+
+
+def _ler(path: str) -> Callable[[], bytes]:
+    return lambda: Path(path).read_bytes()
+
+
+def galeria(titulo: str, zip_rotulo: str, zip_nome: str) -> None:
+    """Galeria + downloads (PNG a PNG, ZIP e prompts.txt). PNG e ZIP são
+    adiados (data=callable): só são lidos/montados quando o usuário clica,
+    e não a cada rerun, nem guardados no armazenamento de mídia da sessão."""
+    if not st.session_state["imgs"]:
+        return
+    st.header(titulo)
+    for idx, item in enumerate(st.session_state["imgs"]):
+        st.image(item["thumb"], caption=item["name"], use_column_width=True)
+        st.download_button(
+            f"Baixar {item['name']}",
+            _ler(item["path"]),
+            file_name=item["name"],
+            mime="image/png",
+            key=f"dl-{idx}-{item['name']}"
+        )
+
+    itens = tuple((itm["path"], itm["name"]) for itm in st.session_state["imgs"])
+    st.download_button(zip_rotulo, lambda: montar_zip(itens), zip_nome, "application/zip")
+
+    # Prompts.txt
+    txt = prompts_txt(tuple((itm["name"], itm["prompt"]) for itm in st.session_state["imgs"]))
+    st.download_button(
+        "⬇️ Baixar Prompts (.txt)", txt, "prompts.txt", "text/plain"
+    )
+
+
+def app_gemini(*, estilo: str, modelo_txt: str, pedido: str, pedido_lote: str,
+               modelo_img: str = "gemini-2.0-flash-preview-image-generation", api_version_img: str = "v1alpha",
+               tries: int = 2, pausa: float = 1.5, zip_nome: str = "output_imagens.zip") -> None:
+    """Página inteira SRT → prompt (Gemini texto) → imagem (Gemini imagem)."""
+    iniciar_sessao()
+    st.set_page_config(page_title="SRT ▶︎ Gemini Imagens", layout="wide")
+    st.title("🎞️ SRT → Gemini Flash → Imagens Cinematográficas")
+
+    # Autenticação
+    api_key = st.secrets.get("GEMINI_API_KEY")
+    if not api_key:
+        st.error("Configure GEMINI_API_KEY em Settings ▸ Secrets.")
+        st.stop()
+    # Só o hash entra nas chaves do cache em disco, nunca a chave crua
+    api_key_hash = hashlib.blake2b(api_key.encode()).hexdigest()[:16]
+    client_txt, client_img = get_clients(api_key, api_version_img)
+
+    # Controles
+    min_w = st.sidebar.number_input("Mín. palavras/bloco", 10, 30, 20)
+    max_w = st.sidebar.number_input("Máx. palavras/bloco", 20, 60, 30)
+    refinar = st.sidebar.checkbox("Refinar prompt com Flash (lento)", value=False)
+    forcar = st.sidebar.checkbox("Forçar regeração (ignorar cache)", value=False)
+    semantico = st.sidebar.checkbox("Reaproveitar imagem de prompts parecidos (embeddings)", value=False)
+    selected_idxs, selected_ts = filtros()
+
+    uploaded = st.file_uploader("📂 Faça upload do .srt", type="srt")
+
+    prompts = Prompts(client_txt, modelo_txt, estilo, pedido, pedido_lote, api_key_hash, forcar)
+    imagens = ImagensGemini(client_txt, client_img, modelo_img, api_key_hash, forcar, tries, pausa)
+    pipeline = dict(
+        gerar_imagem=imagens.gerar, direto=prompts.direto, prontos=st.session_state["prompts"],
+        refinar=prompts.lote if refinar else None, equivalente=imagens.equivalente if semantico else None,
+        forcar=forcar,
+    )
+
+    # Sessão nova (ou F5): última rodada deste app em disco
+    app_dir = pasta_app("gemini", estilo, modelo_txt, modelo_img)
+    restaurar_rodada(app_dir)
+
+    # ─── Botão: Gerar Imagens ──────────────────────
+    if st.button("🚀 Gerar Imagens"):
+        st.session_state["prompts"] = pipeline["prontos"] = {}
+
+        if not uploaded:
+            st.warning("Envie um .srt primeiro.")
+            st.stop()
+
+        blocos = nova_rodada(app_dir, uploaded, min_w, max_w, refinar, semantico)
+        st.info(f"{len(blocos)} blocos total; aplicando filtros...")
+        rodar(selecionar(blocos, selected_idxs, selected_ts), st.progress(0.0), **pipeline)
+        st.success("✔️ Processamento concluído!")
+
+    # ─── Botão: Reprocessar falhas ─────────────────
+    if st.session_state["blocos"] and st.button("🔄 Reprocessar falhas"):
+        prog = st.progress(0.0)
+        feitos = {item["name"] for item in st.session_state["imgs"]}
+        rodar(selecionar(st.session_state["blocos"], selected_idxs, selected_ts, feitos), prog, **pipeline)
+        st.success("🔄 Reprocessamento concluído!")
+
+    # Avisos do reaproveitamento por embeddings (as threads do pool não falam com a página)
+    if imagens.sem_embedding:
+        st.warning(f"⚠️ Embeddings indisponíveis ({MODELO_EMBED}): {imagens.sem_embedding}. "
+                   "Nenhuma imagem foi reaproveitada por semelhança nesta rodada.")
+    elif imagens.falhas_embedding:
+        st.toast(f"⏳ {imagens.falhas_embedding} prompt(s) sem embedding (limite de taxa ou erro passageiro): "
+                 "gerados sem reaproveitamento.")
+
+    # ─── Galeria + downloads ──────────────────────
+    galeria("📸 Imagens Geradas", "⬇️ Baixar todas as imagens (.zip)", zip_nome)